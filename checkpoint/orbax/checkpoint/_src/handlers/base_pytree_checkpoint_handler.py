@@ -71,19 +71,6 @@ DEFAULT_CONCURRENT_GB = 96
 
 
 
-async def _create_param_save_dir(param_info: ParamInfo):
-  # Directory will be unused.
-  path = param_info.path
-  if path is None:
-    return
-  # TODO(b/273803615): Note that keys with slashes ('/', generated by Haiku,
-  # for example) will result in the creation of nested sub-directories, rather
-  # than flat parameter directories like for a standard nested PyTree. This
-  # discrepancy, while potentially problematic, will not be addressed since we
-  # anticipate moving fully to OCDBT within a quarter or two.
-  await utils.async_makedirs(path, parents=True)
-
-
 def _default_sizeof_values(values: Sequence[Any]) -> Sequence[int]:
   return [sys.getsizeof(v) for v in values]
 
@@ -130,6 +117,8 @@ class _BatchRequest:
     values: Values to serialize.
     infos: ParamInfos.
     args: List of SaveArgs or RestoreArgs.
+    indices: Positions of the parameters among the flattened leaves from which
+      the request was built.
   """
 
   handler: TypeHandler
@@ -137,6 +126,7 @@ class _BatchRequest:
   values: List[Any]
   infos: List[ParamInfo]
   args: List[Union[SaveArgs, RestoreArgs]]
+  indices: List[int] = dataclasses.field(default_factory=list)
 
   def __post_init__(self):
     length = len(self.values)
@@ -144,29 +134,44 @@ class _BatchRequest:
         length == len(self.infos),
         length == len(self.args),
         length == len(self.keys),
+        length == len(self.indices),
     )):
       raise AssertionError('Found `_BatchRequest` with mismatched parameters.')
 
 
-def batched_serialization_requests(
-    tree: PyTree,
-    param_infos: PyTree,
-    args: PyTree,
+def batched_serialization_requests_from_flat(
+    keypaths: Sequence[Tuple[Any, ...]],
+    infos: Sequence[ParamInfo],
+    values: Sequence[Union[Any, tree_metadata.ValueMetadataEntry]],
+    args: Sequence[Union[SaveArgs, RestoreArgs]],
     registry: TypeHandlerRegistry,
 ) -> List[_BatchRequest]:
-  """Gets a list of batched serialization or deserialization requests."""
+  """Same as `batched_serialization_requests`, for already flattened trees.
+
+  All sequences must correspond to the same flattened leaves, see
+  `batched_serialization_requests`. `_BatchRequest.indices` refers to positions
+  in these sequences.
+
+  Args:
+    keypaths: JAX keypaths of the leaves.
+    infos: ParamInfo for each leaf.
+    values: Value (or ValueMetadataEntry) for each leaf.
+    args: SaveArgs or RestoreArgs for each leaf.
+    registry: Used to look up the TypeHandler for each leaf.
+
+  Returns:
+    A list of batched requests, one per TypeHandler.
+  """
   grouped = {}
+  # Registry lookups may scan every registered type, but trees usually only
+  # contain a handful of distinct types.
+  handler_cache = {}
 
-  def _group_value(
-      keypath: Tuple[Any, ...],
-      info: ParamInfo,
-      value: Union[Any, tree_metadata.ValueMetadataEntry],
-      arg: Union[SaveArgs, RestoreArgs],
+  for i, (keypath, info, value, arg) in enumerate(
+      zip(keypaths, infos, values, args)
   ):
-    nonlocal grouped
-    tuple_key = tree_utils.tuple_path_from_keypath(keypath)
     if info.skip_deserialize:
-      return
+      continue
 
     if isinstance(arg, RestoreArgs):
       assert isinstance(value, tree_metadata.ValueMetadataEntry), type(value)
@@ -176,47 +181,61 @@ def batched_serialization_requests(
       # is not the same as the metadata_restore_type.
       if type_handlers.is_empty_typestr(requested_restore_type):
         # Skip deserialization of empty node using TypeHandler.
-        return
+        continue
       type_for_registry_lookup = requested_restore_type
     elif isinstance(arg, SaveArgs):
       # Skip serialization of empty node using TypeHandler.
       if tree_utils.is_empty_node(value):
-        return
+        continue
       type_for_registry_lookup = type(value)
     else:
       raise AssertionError(
           f'Expected `RestoreArgs` or `SaveArgs`. Got {type(arg)}.'
       )
 
-    try:
-      handler = registry.get(type_for_registry_lookup)
-    except ValueError as e:
-      raise ValueError(
-          f'TypeHandler lookup failed for: type={type_for_registry_lookup},'
-          f' keypath={keypath}, ParamInfo={info}, RestoreArgs={arg},'
-          f' value={value}'
-      ) from e
+    handler = handler_cache.get(type_for_registry_lookup)
+    if handler is None:
+      try:
+        handler = registry.get(type_for_registry_lookup)
+      except ValueError as e:
+        raise ValueError(
+            f'TypeHandler lookup failed for: type={type_for_registry_lookup},'
+            f' keypath={keypath}, ParamInfo={info}, RestoreArgs={arg},'
+            f' value={value}'
+        ) from e
+      handler_cache[type_for_registry_lookup] = handler
 
     if handler not in grouped:
       grouped[handler] = _BatchRequest(handler, [], [], [], [])
     request = grouped[handler]
-    grouped[handler] = dataclasses.replace(
-        request,
-        keys=request.keys + [tuple_key],
-        values=request.values + [value],
-        infos=request.infos + [info],
-        args=request.args + [arg],
-    )
+    request.keys.append(tree_utils.tuple_path_from_keypath(keypath))
+    request.values.append(value)
+    request.infos.append(info)
+    request.args.append(arg)
+    request.indices.append(i)
 
-  jax.tree_util.tree_map_with_path(
-      _group_value,
-      param_infos,
-      tree,
-      args,
-  )
   return list(grouped.values())
 
 
+def batched_serialization_requests(
+    tree: PyTree,
+    param_infos: PyTree,
+    args: PyTree,
+    registry: TypeHandlerRegistry,
+) -> List[_BatchRequest]:
+  """Gets a list of batched serialization or deserialization requests."""
+  flat_infos_with_keys, treedef = jax.tree_util.tree_flatten_with_path(
+      param_infos
+  )
+  return batched_serialization_requests_from_flat(
+      [keypath for keypath, _ in flat_infos_with_keys],
+      [info for _, info in flat_infos_with_keys],
+      treedef.flatten_up_to(tree),
+      treedef.flatten_up_to(args),
+      registry,
+  )
+
+
 def _fill_missing_save_or_restore_args(
     item: PyTree, args: Optional[PyTree], *, mode: str
 ) -> PyTree:
@@ -348,7 +367,6 @@ class BasePyTreeCheckpointHandler(
     """
     if use_zarr3 is None:
       use_zarr3 = self._use_zarr3
-    names = self.get_param_names(item)
     ts_context = type_handlers.get_ts_context()
 
     def _param_info(name, value):
@@ -371,8 +389,27 @@ class BasePyTreeCheckpointHandler(
           ),
       )
 
-    return jax.tree.map(
-        _param_info, names, item, is_leaf=utils.is_empty_or_leaf
+    flat_with_keys, treedef = jax.tree_util.tree_flatten_with_path(
+        item, is_leaf=utils.is_empty_or_leaf
+    )
+    if (
+        type(self).get_param_names
+        is BasePyTreeCheckpointHandler.get_param_names
+    ):
+      # Names are computed from the same keypaths as `get_param_names`, but in
+      # the traversal which also builds the ParamInfos.
+      flat_names = [
+          tree_utils.param_name_from_keypath(keypath)
+          for keypath, _ in flat_with_keys
+      ]
+    else:
+      flat_names = treedef.flatten_up_to(self.get_param_names(item))
+    return jax.tree.unflatten(
+        treedef,
+        [
+            _param_info(name, value)
+            for name, (_, value) in zip(flat_names, flat_with_keys)
+        ],
     )
 
   async def async_save(
@@ -452,6 +489,13 @@ class BasePyTreeCheckpointHandler(
       tree_memory_size += _get_batch_memory_size(
           request.handler, request.values
       )
+    # The metadata file only depends on `param_infos` and `save_args`, so it
+    # can be written in the background while parameters are being copied.
+    metadata_future = None
+    if multihost.is_primary_host(self._primary_host):
+      metadata_future = self._write_metadata_file(
+          directory, param_infos, save_args, self._use_zarr3
+      )
     # Await copy futures. Returns list of lists.
     commit_futures = await asyncio.gather(*serialize_ops)
     commit_futures, _ = jax.tree.flatten(commit_futures)
@@ -460,12 +504,8 @@ class BasePyTreeCheckpointHandler(
       logging.vlog(1, 'param_info: %s', param_infos)
       logging.vlog(1, 'save_args: %s', save_args)
 
-    if multihost.is_primary_host(self._primary_host):
-      commit_futures.append(
-          self._write_metadata_file(
-              directory, param_infos, save_args, self._use_zarr3
-          )
-      )
+    if metadata_future is not None:
+      commit_futures.append(metadata_future)
 
     _log_io_per_sec_metric(
         '/jax/checkpoint/write/blocking_bytes_per_sec',
@@ -516,13 +556,6 @@ class BasePyTreeCheckpointHandler(
   ) -> Tuple[int, PyTree]:
     """Deserializes values or skips."""
     flat_metadata = tree_utils.to_flat_dict(metadata)
-    byte_limiter = serialization.get_byte_limiter(
-        self._restore_concurrent_bytes
-    )
-    param_infos = jax.tree.map(
-        lambda info: dataclasses.replace(info, byte_limiter=byte_limiter),
-        param_infos,
-    )
     batch_requests = batched_serialization_requests(
         metadata,
         param_infos,
@@ -671,11 +704,18 @@ class BasePyTreeCheckpointHandler(
     )
     if not metadata:
       raise ValueError('Found empty metadata.')
+    concurrent_bytes = (
+        self._restore_concurrent_bytes
+        if args.concurrent_bytes is None
+        else args.concurrent_bytes
+    )
+    byte_limiter = serialization.get_byte_limiter(concurrent_bytes)
     param_infos = self._get_param_infos(
         metadata,
         directory,
         use_ocdbt=type_handlers.is_ocdbt_checkpoint(directory),
         use_zarr3=use_zarr3,
+        byte_limiter=byte_limiter,
     )
     tree_memory_size, restored_item = asyncio_utils.run_sync(
         self._maybe_deserialize(item, metadata, param_infos, restore_args)
@@ -849,7 +889,11 @@ class BasePyTreeRestoreArgs(CheckpointArgs):
       leaf as a certain type, a specific subclass of `RestoreArgs` may be
       required. `RestoreArgs` also provides the option to customize the
       restore type of an individual leaf.
+    concurrent_bytes: max concurrent bytes that are allowed to be read for this
+      restore, overriding the handler's `restore_concurrent_bytes`. Limits how
+      many parameter reads from TensorStore may be in flight at once.
   """
 
   item: Optional[PyTree] = None
   restore_args: Optional[PyTree] = None
+  concurrent_bytes: Optional[int] = None
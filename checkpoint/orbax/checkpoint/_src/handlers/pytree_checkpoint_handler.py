@@ -26,7 +26,7 @@ import dataclasses
 import json
 import re
 import typing
-from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 
 from absl import logging
 from etils import epath
@@ -75,6 +75,9 @@ PYTREE_METADATA_FILE = base_pytree_checkpoint_handler.PYTREE_METADATA_FILE
 _CHECKPOINT_FILE = 'checkpoint'
 _METADATA_FILE = PYTREE_METADATA_FILE
 DEFAULT_CONCURRENT_GB = base_pytree_checkpoint_handler.DEFAULT_CONCURRENT_GB
+# RestoreArgs are never mutated after construction, so a single default
+# instance can be shared by every leaf without explicit restore_args.
+_DEFAULT_RESTORE_ARGS = RestoreArgs()
 
 
 def _maybe_set_default_restore_args(args):
@@ -99,6 +102,9 @@ def _maybe_shard_array(value, args):
     sharding = args.sharding or jax.sharding.NamedSharding(
         args.mesh, args.mesh_axes
     )
+    if sharding.is_fully_replicated and sharding.is_fully_addressable:
+      # Every device holds the full value, so there is nothing to slice.
+      return jax.device_put(value, sharding)
     value = jax.make_array_from_callback(
         value.shape, sharding, lambda idx: value[idx]
     )
@@ -109,25 +115,115 @@ def _keystr(key: Tuple[Any, ...]) -> str:
   return '/'.join(key)
 
 
+def _is_literal_pattern(pattern: str) -> bool:
+  return re.escape(pattern) == pattern
+
+
+@dataclasses.dataclass
+class _CompiledTransforms:
+  """Transforms preprocessed for repeated matching against input keys.
+
+  Transform keys without regex metacharacters which neither rename the key nor
+  use `multi_value_fn` or `use_fallback` (the common case) can only match an
+  input key with an identical string representation, so they are looked up in
+  a dict instead of being matched as a regex. All other transforms keep their
+  original order so that the first matching transform still wins.
+
+  Attributes:
+    literal_transforms: Maps the string form of a literal transform key to the
+      index of the first such transform in the flattened transforms.
+    regex_transforms: (index, compiled key pattern, transform) for every
+      transform not in `literal_transforms`.
+    multi_value_fn_input_args: Compiled `multi_value_fn_input_args` patterns,
+      keyed by transform index.
+    literal_fallback_keys: String forms of literal `use_fallback` transform
+      keys.
+    regex_fallback_patterns: Compiled patterns of all other `use_fallback`
+      transform keys.
+  """
+
+  literal_transforms: Dict[str, int]
+  regex_transforms: List[Tuple[int, re.Pattern[str], Transform]]
+  multi_value_fn_input_args: Dict[
+      int, List[Tuple[re.Pattern[str], RestoreArgs]]
+  ]
+  literal_fallback_keys: Set[str]
+  regex_fallback_patterns: List[re.Pattern[str]]
+
+
+def _compile_transforms(
+    flat_transforms: Dict[TupleKey, Transform],
+) -> _CompiledTransforms:
+  """Compiles transform key regexes once, see `_CompiledTransforms`."""
+  compiled = _CompiledTransforms({}, [], {}, set(), [])
+  for i, (transform_key, transform) in enumerate(flat_transforms.items()):
+    transform_key_str = _keystr(transform_key)
+    is_literal = _is_literal_pattern(transform_key_str)
+    if transform.use_fallback:
+      if is_literal:
+        compiled.literal_fallback_keys.add(transform_key_str)
+      else:
+        compiled.regex_fallback_patterns.append(re.compile(transform_key_str))
+    if (
+        is_literal
+        and transform.multi_value_fn is None
+        and not transform.use_fallback
+        and transform.original_key is None
+    ):
+      compiled.literal_transforms.setdefault(transform_key_str, i)
+      continue
+    compiled.regex_transforms.append(
+        (i, re.compile(transform_key_str), transform)
+    )
+    if (
+        transform.multi_value_fn is not None
+        and isinstance(transform, RestoreTransform)
+        and transform.multi_value_fn_input_args is not None
+    ):
+      compiled.multi_value_fn_input_args[i] = [
+          (re.compile(input_key_regex), input_args)
+          for input_key_regex, input_args in (
+              transform.multi_value_fn_input_args.items()
+          )
+      ]
+  return compiled
+
+
 def _find_matching_input_args(
     input_key: TupleKey,
-    flat_item: Dict[TupleKey, Any],
-    flat_transforms: Dict[TupleKey, Transform],
+    flat_item_keys: List[Tuple[TupleKey, str]],
+    flat_item_strs: Dict[str, TupleKey],
+    compiled_transforms: _CompiledTransforms,
     flat_restore_args: Dict[TupleKey, RestoreArgs],
 ) -> Optional[RestoreArgs]:
   """Given an input_key, tries to find matching RestoreArgs for the input.
 
   Args:
     input_key: A key in the input tree.
-    flat_item: The flattened, user-provided item.
-    flat_transforms: Flattened transformations dict.
+    flat_item_keys: Keys of the flattened, user-provided item, paired with
+      their string forms.
+    flat_item_strs: Maps the string form of each key in the flattened item to
+      the first key with that string form.
+    compiled_transforms: See `_compile_transforms`.
     flat_restore_args: Flattened tree of RestoreArgs, relative to item.
 
   Returns:
     RestoreArgs that match the given input_key, according to the
     transformations, or None if no match is found.
   """
-  for transform_key, transform in flat_transforms.items():
+  input_key_str = _keystr(input_key)
+  # A transform which does not rename the key can only match the item key with
+  # the same string form as the input key.
+  same_output_key = flat_item_strs.get(input_key_str)
+  literal_index = None
+  if same_output_key is not None:
+    literal_index = compiled_transforms.literal_transforms.get(input_key_str)
+
+  for i, transform_key_pattern, transform in (
+      compiled_transforms.regex_transforms
+  ):
+    if literal_index is not None and i > literal_index:
+      break
     if transform.multi_value_fn is not None:
       if not isinstance(transform, RestoreTransform):
         raise ValueError(
@@ -141,38 +237,50 @@ def _find_matching_input_args(
             ' specified to identify inputs for the function.'
         )
       for (
-          input_key_regex,
+          input_key_pattern,
           input_args,
-      ) in transform.multi_value_fn_input_args.items():
-        if re.fullmatch(input_key_regex, _keystr(input_key)):
+      ) in compiled_transforms.multi_value_fn_input_args[i]:
+        if input_key_pattern.fullmatch(input_key_str):
           return input_args
     elif not transform.use_fallback:
-      # The following is done to reverse-engineer the regex for the key in
-      # the original tree.
-      for output_key in flat_item:
-        match = re.fullmatch(_keystr(transform_key), _keystr(output_key))
-        if match:
-          if transform.original_key is None:
-            # If transform.original_key is not specified, this transform
-            # does not rename the original key. We can reuse the key from
-            # the item.
-            input_key_pattern = _keystr(output_key)
-          else:
+      if transform.original_key is None:
+        # If transform.original_key is not specified, this transform does not
+        # rename the original key. We can reuse the key from the item.
+        if same_output_key is not None and transform_key_pattern.fullmatch(
+            input_key_str
+        ):
+          return flat_restore_args[same_output_key]
+      else:
+        # The following is done to reverse-engineer the regex for the key in
+        # the original tree.
+        for output_key, output_key_str in flat_item_keys:
+          match = transform_key_pattern.fullmatch(output_key_str)
+          if match:
             input_key_pattern = match.expand(transform.original_key)
-          if input_key_pattern == _keystr(input_key):
-            return flat_restore_args[output_key]
+            if input_key_pattern == input_key_str:
+              return flat_restore_args[output_key]
+  if literal_index is not None:
+    return flat_restore_args[same_output_key]
   return None
 
 
 def _has_use_fallback_transform(
-    input_key: TupleKey, flat_transforms: Dict[TupleKey, Transform]
+    input_key: TupleKey, compiled_transforms: _CompiledTransforms
 ) -> bool:
-  result = False
-  for transform_key, transform in flat_transforms.items():
-    match = re.fullmatch(_keystr(transform_key), _keystr(input_key))
-    if match and transform.use_fallback:
-      result = True
-  return result
+  input_key_str = _keystr(input_key)
+  if input_key_str in compiled_transforms.literal_fallback_keys:
+    return True
+  return any(
+      pattern.fullmatch(input_key_str)
+      for pattern in compiled_transforms.regex_fallback_patterns
+  )
+
+
+def _default_restore_args_for(meta_or_value: Any) -> Any:
+  """Returns the shared default RestoreArgs, or the empty node itself."""
+  if type_handlers.is_supported_empty_value(meta_or_value):
+    return meta_or_value
+  return _DEFAULT_RESTORE_ARGS
 
 
 def _get_restore_parameters(
@@ -226,17 +334,19 @@ def _get_restore_parameters(
   Returns:
     Tuple of param_infos, and restore_args.
   """
-  flat_structure = tree_utils.to_flat_dict(structure, keep_empty_nodes=True)
-  if param_names is None:
-    param_names = get_param_names(structure)
-  flat_param_names = tree_utils.to_flat_dict(param_names, keep_empty_nodes=True)
-  if restore_args is None:
-    restore_args = jax.tree.map(lambda x: RestoreArgs(), structure)
-  flat_restore_args = tree_utils.to_flat_dict(
-      restore_args, keep_empty_nodes=True
+  structure_leaves_with_path, structure_treedef = (
+      jax.tree_util.tree_flatten_with_path(
+          structure, is_leaf=tree_utils.is_empty_or_leaf
+      )
   )
-  flat_param_infos = {}
-  flat_input_restore_args = {}
+  if param_names is None:
+    flat_param_names = [
+        tree_utils.param_name_from_keypath(keypath)
+        for keypath, _ in structure_leaves_with_path
+    ]
+  else:
+    flat_param_names = structure_treedef.flatten_up_to(param_names)
+  flat_param_infos = []
   is_ocdbt_checkpoint = type_handlers.is_ocdbt_checkpoint(directory)
   ts_context = type_handlers.get_ts_context()
 
@@ -264,73 +374,102 @@ def _get_restore_parameters(
     )
 
   if transforms is None:
-    for key, meta in flat_structure.items():
-      flat_param_infos[key] = _get_param_info(flat_param_names[key], meta)
-    restore_args = tree_utils.serialize_tree(
-        restore_args,
-        keep_empty_nodes=True,
-    )
+    for (_, meta), name in zip(structure_leaves_with_path, flat_param_names):
+      flat_param_infos.append(_get_param_info(name, meta))
+    if restore_args is None:
+      restore_args = tree_utils.from_flattened_with_keypath([
+          (keypath, _default_restore_args_for(meta))
+          for keypath, meta in structure_leaves_with_path
+      ])
+    else:
+      restore_args = tree_utils.serialize_tree(
+          restore_args,
+          keep_empty_nodes=True,
+      )
   else:
     if item is None:
       raise ValueError(
           'If providing `transforms`, must provide `item` matching structure'
           ' of expected result.'
       )
+    if restore_args is None:
+      flat_restore_args = {
+          tree_utils.tuple_path_from_keypath(keypath): (
+              _default_restore_args_for(meta)
+          )
+          for keypath, meta in structure_leaves_with_path
+      }
+    else:
+      flat_restore_args = tree_utils.to_flat_dict(
+          restore_args, keep_empty_nodes=True
+      )
     flat_item = tree_utils.to_flat_dict(item, keep_empty_nodes=True)
     flat_transforms = tree_utils.to_flat_dict(transforms)
-
-    for input_key, meta in flat_structure.items():
+    flat_item_keys = [(k, _keystr(k)) for k in flat_item]
+    flat_item_strs = {}
+    for output_key, output_key_str in flat_item_keys:
+      flat_item_strs.setdefault(output_key_str, output_key)
+    compiled_transforms = _compile_transforms(flat_transforms)
+    flat_input_restore_args = []
+
+    for (keypath, meta), name in zip(
+        structure_leaves_with_path, flat_param_names
+    ):
+      if type_handlers.is_supported_empty_value(meta):
+        # Empty nodes are carried over from the checkpoint structure as-is.
+        flat_param_infos.append(meta)
+        flat_input_restore_args.append(meta)
+        continue
+      input_key = tree_utils.tuple_path_from_keypath(keypath)
       maybe_input_args = _find_matching_input_args(
-          input_key, flat_item, flat_transforms, flat_restore_args
+          input_key,
+          flat_item_keys,
+          flat_item_strs,
+          compiled_transforms,
+          flat_restore_args,
       )
       if maybe_input_args:
-        flat_param_infos[input_key] = _get_param_info(
-            flat_param_names[input_key], meta
-        )
-        flat_input_restore_args[input_key] = maybe_input_args
-      elif input_key in flat_item and input_key in flat_structure:
+        flat_param_infos.append(_get_param_info(name, meta))
+        flat_input_restore_args.append(maybe_input_args)
+      elif input_key in flat_item:
         # Key is present in both input and output.
-        if _has_use_fallback_transform(input_key, flat_transforms):
+        if _has_use_fallback_transform(input_key, compiled_transforms):
           # Indicates that a `use_fallback` transformation was specified.
           if transforms_default_to_original:
             # Specified `use_fallback`, but key was also present in the
             # checkpoint. This means we should skip loading, since it will be
             # overridden with a new value.
-            flat_param_infos[input_key] = ParamInfo(skip_deserialize=True)
-            flat_input_restore_args[input_key] = RestoreArgs()
+            flat_param_infos.append(ParamInfo(skip_deserialize=True))
+            flat_input_restore_args.append(_DEFAULT_RESTORE_ARGS)
           else:
             # Specified `use_fallback`, but `transforms_default_to_original`
             # is False. This means we draw the value from the user-provided
             # `item`.
-            flat_param_infos[input_key] = _get_param_info(
-                flat_param_names[input_key], meta
-            )
-            flat_input_restore_args[input_key] = flat_restore_args[input_key]
+            flat_param_infos.append(_get_param_info(name, meta))
+            flat_input_restore_args.append(flat_restore_args[input_key])
         else:
           # Transform not specified.
           if transforms_default_to_original:
             # Key/value is carried over from the original unchanged.
-            flat_param_infos[input_key] = _get_param_info(
-                flat_param_names[input_key], meta
-            )
-            flat_input_restore_args[input_key] = flat_restore_args[input_key]
+            flat_param_infos.append(_get_param_info(name, meta))
+            flat_input_restore_args.append(flat_restore_args[input_key])
           else:
             # Take the value from the user-provided `item`, ignoring any value
             # in the checkpoint.
-            flat_param_infos[input_key] = ParamInfo(skip_deserialize=True)
-            flat_input_restore_args[input_key] = RestoreArgs()
+            flat_param_infos.append(ParamInfo(skip_deserialize=True))
+            flat_input_restore_args.append(_DEFAULT_RESTORE_ARGS)
       else:
         # No match, restoration not required since it will be dropped from the
         # output.
-        flat_param_infos[input_key] = ParamInfo(skip_deserialize=True)
-        flat_input_restore_args[input_key] = RestoreArgs()
+        flat_param_infos.append(ParamInfo(skip_deserialize=True))
+        flat_input_restore_args.append(_DEFAULT_RESTORE_ARGS)
 
-    restore_args = tree_utils.from_flat_dict(
-        flat_input_restore_args, target=structure
+    restore_args = jax.tree.unflatten(
+        structure_treedef, flat_input_restore_args
     )
 
   return (
-      tree_utils.from_flat_dict(flat_param_infos, target=structure),
+      jax.tree.unflatten(structure_treedef, flat_param_infos),
       restore_args,
   )
 
@@ -571,19 +710,31 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
 
   async def _maybe_deserialize(
       self,
-      item: PyTree,
       metadata: PyTree,
       param_infos: PyTree,
       restore_args: PyTree,
   ) -> PyTree:
-    """Deserializes values or gets them from the aggregate file."""
-    byte_limiter = serialization.get_byte_limiter(
-        self._restore_concurrent_bytes
-    )
-    param_infos = jax.tree.map(
-        lambda info: dataclasses.replace(info, byte_limiter=byte_limiter),
-        param_infos,
+    """Deserializes values or gets them from the aggregate file.
+
+    The trees are flattened once; restored values are placed back by leaf
+    index, and the result is unflattened with the structure of `param_infos`.
+
+    Args:
+      metadata: Checkpoint structure, with leaves of ValueMetadataEntry or
+        aggregated values.
+      param_infos: ParamInfos with the same structure as `metadata`.
+      restore_args: RestoreArgs with the same structure as `metadata`.
+
+    Returns:
+      The restored tree.
+    """
+    flat_infos_with_keys, treedef = jax.tree_util.tree_flatten_with_path(
+        param_infos
     )
+    keypaths = [keypath for keypath, _ in flat_infos_with_keys]
+    flat_param_infos = [info for _, info in flat_infos_with_keys]
+    flat_metadata = treedef.flatten_up_to(metadata)
+    flat_restore_args = treedef.flatten_up_to(restore_args)
 
     # Handle parameters from aggregate file.
     def _process_aggregated_value(meta_or_value, args):
@@ -592,37 +743,30 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
         meta_or_value = _maybe_shard_array(meta_or_value, args)
       return meta_or_value
 
-    flat_aggregate = tree_utils.to_flat_dict(
-        jax.tree_util.tree_map(
-            _process_aggregated_value, metadata, restore_args
-        ),
-    )
+    flat_restored = [
+        _process_aggregated_value(meta_or_value, args)
+        for meta_or_value, args in zip(flat_metadata, flat_restore_args)
+    ]
 
     batch_requests = (
-        base_pytree_checkpoint_handler.batched_serialization_requests(
-            metadata,
-            param_infos,
-            restore_args,
+        base_pytree_checkpoint_handler.batched_serialization_requests_from_flat(
+            keypaths,
+            flat_param_infos,
+            flat_metadata,
+            flat_restore_args,
             self._type_handler_registry,
         )
     )
-    deserialized_batches = []
-    deserialized_batches_ops = []
-    for request in batch_requests:
-      deserialized_batches_ops.append(
-          request.handler.deserialize(request.infos, request.args)
-      )
-    deserialized_batches += await asyncio.gather(*deserialized_batches_ops)
+    deserialized_batches = await asyncio.gather(*[
+        request.handler.deserialize(request.infos, request.args)
+        for request in batch_requests
+    ])
 
-    flat_restored = {}
+    # Values which were not deserialized come from the aggregate file.
     for request, deserialized in zip(batch_requests, deserialized_batches):
-      for key, value in zip(request.keys, deserialized):
-        flat_restored[key] = value
-    # Add in any values which were not deserialized, coming from aggregate file.
-    for key in flat_aggregate.keys():
-      if key not in flat_restored:
-        flat_restored[key] = flat_aggregate[key]
-    return tree_utils.from_flat_dict(flat_restored, target=item)
+      for index, value in zip(request.indices, deserialized):
+        flat_restored[index] = value
+    return jax.tree.unflatten(treedef, flat_restored)
 
   def restore(
       self,
@@ -743,6 +887,11 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
     transforms = args.transforms
     transforms_default_to_original = args.transforms_default_to_original
     legacy_transform_fn = args.legacy_transform_fn
+    concurrent_bytes = (
+        None
+        if args.concurrent_gb is None
+        else _concurrent_bytes(args.concurrent_gb)
+    )
 
     try:
       can_ignore_aggregate_file = utils.all_leaves_are_placeholders(
@@ -763,6 +912,7 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
       args = BasePyTreeRestoreArgs(
           item,
           restore_args=restore_args,
+          concurrent_bytes=concurrent_bytes,
       )
       return self._handler_impl.restore(directory, args=args)
 
@@ -775,6 +925,11 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
     # `checkpoint_restore_args` has a structure relative to the checkpoint,
     # while `restore_args` remains structured relative to the output.
 
+    byte_limiter = serialization.get_byte_limiter(
+        self._restore_concurrent_bytes
+        if concurrent_bytes is None
+        else concurrent_bytes
+    )
     param_infos, checkpoint_restore_args = _get_restore_parameters(
         directory,
         item,
@@ -782,6 +937,7 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
         self._handler_impl.get_param_names(structure),
         transforms,
         restore_args,
+        byte_limiter=byte_limiter,
         transforms_default_to_original=transforms_default_to_original,
         use_zarr3=use_zarr3_metadata
         if use_zarr3_metadata is not None
@@ -794,8 +950,12 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
       )
     if legacy_transform_fn is not None:
       structure, param_infos = legacy_transform_fn(item, structure, param_infos)
+      param_infos = jax.tree.map(
+          lambda info: dataclasses.replace(info, byte_limiter=byte_limiter),
+          param_infos,
+      )
       if restore_args is None:
-        restore_args = jax.tree.map(lambda x: RestoreArgs(), item)
+        restore_args = jax.tree.map(lambda x: _DEFAULT_RESTORE_ARGS, item)
       checkpoint_restore_args = restore_args
 
     def _maybe_set_default_restore_types(value_meta: Any, arg: RestoreArgs):
@@ -816,9 +976,7 @@ class PyTreeCheckpointHandler(async_checkpoint_handler.AsyncCheckpointHandler):
     )
 
     restored_item = asyncio_utils.run_sync(
-        self._maybe_deserialize(
-            structure, structure, param_infos, checkpoint_restore_args
-        )
+        self._maybe_deserialize(structure, param_infos, checkpoint_restore_args)
     )
 
     if not legacy_transform_fn:
@@ -1062,6 +1220,9 @@ class PyTreeRestoreArgs(CheckpointArgs):
       of ParamInfos based on the checkpoint. Returns a transformed PyTree
       matching the desired return tree structure, and a matching ParamInfo
       tree.
+    concurrent_gb: max concurrent GB that are allowed to be read for this
+      restore, overriding the handler's `restore_concurrent_gb`. Limits how
+      many parameter reads from TensorStore may be in flight at once.
   """
 
   item: Optional[PyTree] = None
@@ -1069,3 +1230,4 @@ class PyTreeRestoreArgs(CheckpointArgs):
   transforms: Optional[PyTree] = None
   transforms_default_to_original: bool = True
   legacy_transform_fn: Optional[LegacyTransformFn] = None
+  concurrent_gb: Optional[int] = None
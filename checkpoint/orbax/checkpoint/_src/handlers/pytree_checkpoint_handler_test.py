@@ -0,0 +1,377 @@
+# Copyright 2024 The Orbax Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for PyTreeCheckpointHandler."""
+
+from typing import Any, NamedTuple
+from unittest import mock
+
+from absl.testing import absltest
+from absl.testing import parameterized
+from etils import epath
+import jax
+import numpy as np
+from orbax.checkpoint import serialization
+from orbax.checkpoint import test_utils
+from orbax.checkpoint import transform_utils
+from orbax.checkpoint import type_handlers
+from orbax.checkpoint._src.handlers import base_pytree_checkpoint_handler
+from orbax.checkpoint._src.handlers import pytree_checkpoint_handler
+from orbax.checkpoint.metadata import tree as tree_metadata
+
+# Parse absl flags test_srcdir and test_tmpdir.
+jax.config.parse_flags_with_absl()
+
+BasePyTreeCheckpointHandler = (
+    base_pytree_checkpoint_handler.BasePyTreeCheckpointHandler
+)
+BasePyTreeRestoreArgs = base_pytree_checkpoint_handler.BasePyTreeRestoreArgs
+BasePyTreeSaveArgs = base_pytree_checkpoint_handler.BasePyTreeSaveArgs
+ParamInfo = type_handlers.ParamInfo
+PyTreeCheckpointHandler = pytree_checkpoint_handler.PyTreeCheckpointHandler
+PyTreeRestoreArgs = pytree_checkpoint_handler.PyTreeRestoreArgs
+PyTreeSaveArgs = pytree_checkpoint_handler.PyTreeSaveArgs
+RestoreArgs = type_handlers.RestoreArgs
+SaveArgs = type_handlers.SaveArgs
+ArrayRestoreArgs = type_handlers.ArrayRestoreArgs
+Transform = transform_utils.Transform
+
+
+def _metadata_structure(*keys: str):
+  return {
+      k: tree_metadata.ValueMetadataEntry(value_type='np.ndarray')
+      for k in keys
+  }
+
+
+class _RestoredTree(NamedTuple):
+  a: Any
+  b: Any
+  empty: Any
+  renamed: Any
+
+
+@jax.tree_util.register_pytree_with_keys_class
+class _AliasedKeysNode:
+  """Node whose children have different keys with the same string form."""
+
+  def __init__(self, attr_value, dict_value):
+    self.attr_value = attr_value
+    self.dict_value = dict_value
+
+  def tree_flatten_with_keys(self):
+    return (
+        (jax.tree_util.GetAttrKey('x'), self.attr_value),
+        (jax.tree_util.DictKey('x'), self.dict_value),
+    ), None
+
+  @classmethod
+  def tree_unflatten(cls, aux_data, children):
+    del aux_data
+    return cls(*children)
+
+
+class MaybeShardArrayTest(parameterized.TestCase):
+
+  @parameterized.product(
+      mesh_axes=[
+          jax.sharding.PartitionSpec(),
+          jax.sharding.PartitionSpec(None),
+          jax.sharding.PartitionSpec('x'),
+          jax.sharding.PartitionSpec('x', 'y'),
+      ],
+      dtype=[np.float32, np.int32],
+  )
+  def test_matches_make_array_from_callback(self, mesh_axes, dtype):
+    devices = np.asarray(jax.devices())
+    if devices.size % 2 == 0:
+      devices = devices.reshape((-1, 2))
+    else:
+      devices = devices.reshape((-1, 1))
+    mesh = jax.sharding.Mesh(devices, ('x', 'y'))
+    sharding = jax.sharding.NamedSharding(mesh, mesh_axes)
+    global_shape = (devices.shape[0] * 2, 4)
+    value = np.arange(np.prod(global_shape), dtype=dtype)
+    expected = jax.make_array_from_callback(
+        global_shape,
+        sharding,
+        lambda idx: value.reshape(global_shape)[idx],
+    )
+
+    with mock.patch.object(
+        jax, 'make_array_from_callback', wraps=jax.make_array_from_callback
+    ) as make_array_from_callback:
+      restored = pytree_checkpoint_handler._maybe_shard_array(
+          value,
+          ArrayRestoreArgs(
+              mesh=mesh, mesh_axes=mesh_axes, global_shape=global_shape
+          ),
+      )
+    # Fully replicated shardings are placed with `jax.device_put`.
+    self.assertEqual(
+        make_array_from_callback.called, not sharding.is_fully_replicated
+    )
+    self.assertEqual(restored.dtype, expected.dtype)
+    self.assertEqual(restored.shape, expected.shape)
+    self.assertTrue(restored.sharding.is_equivalent_to(expected.sharding, 2))
+    np.testing.assert_array_equal(np.asarray(restored), np.asarray(expected))
+    for shard, expected_shard in zip(
+        restored.addressable_shards, expected.addressable_shards
+    ):
+      self.assertEqual(shard.device, expected_shard.device)
+      np.testing.assert_array_equal(shard.data, expected_shard.data)
+
+
+class GetRestoreParametersTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.directory = epath.Path(self.create_tempdir(name='ckpt').full_path)
+
+  def _get_restore_parameters(
+      self,
+      structure,
+      item,
+      transforms,
+      restore_args,
+      transforms_default_to_original=True,
+  ):
+    return pytree_checkpoint_handler._get_restore_parameters(
+        self.directory,
+        item,
+        structure,
+        None,
+        transforms,
+        restore_args,
+        transforms_default_to_original=transforms_default_to_original,
+    )
+
+  def test_earlier_regex_transform_wins_over_later_literal_key(self):
+    # Flattened transforms are ordered by key, so '(a)x' precedes 'a'.
+    structure = _metadata_structure('a')
+    item = {'ax': 0, 'a': 0}
+    transforms = {
+        '(a)x': Transform(original_key=r'\1'),
+        'a': Transform(),
+    }
+    restore_args = {
+        'ax': RestoreArgs(dtype=np.int8),
+        'a': RestoreArgs(dtype=np.int16),
+    }
+    _, input_restore_args = self._get_restore_parameters(
+        structure, item, transforms, restore_args
+    )
+    self.assertEqual(input_restore_args['a'].dtype, np.int8)
+
+  def test_earlier_literal_key_wins_over_later_regex_transform(self):
+    structure = _metadata_structure('a')
+    item = {'a': 0, 'b': 0}
+    transforms = {
+        'a': Transform(),
+        'b(.*)': Transform(original_key=r'a\1'),
+    }
+    restore_args = {
+        'a': RestoreArgs(dtype=np.int8),
+        'b': RestoreArgs(dtype=np.int16),
+    }
+    _, input_restore_args = self._get_restore_parameters(
+        structure, item, transforms, restore_args
+    )
+    self.assertEqual(input_restore_args['a'].dtype, np.int8)
+
+  @parameterized.parameters(True, False)
+  def test_use_fallback_literal_key(self, transforms_default_to_original):
+    structure = _metadata_structure('a', 'b')
+    item = {'a': 0, 'b': 0}
+    transforms = {'a': Transform(use_fallback=True)}
+    restore_args = {
+        'a': RestoreArgs(dtype=np.int8),
+        'b': RestoreArgs(dtype=np.int16),
+    }
+    param_infos, input_restore_args = self._get_restore_parameters(
+        structure,
+        item,
+        transforms,
+        restore_args,
+        transforms_default_to_original=transforms_default_to_original,
+    )
+    if transforms_default_to_original:
+      # The value for 'a' comes from `item`, so it is not loaded.
+      self.assertTrue(param_infos['a'].skip_deserialize)
+      self.assertIsNone(input_restore_args['a'].dtype)
+      # 'b' is carried over from the checkpoint.
+      self.assertFalse(param_infos['b'].skip_deserialize)
+      self.assertEqual(input_restore_args['b'].dtype, np.int16)
+    else:
+      self.assertFalse(param_infos['a'].skip_deserialize)
+      self.assertEqual(param_infos['a'].name, 'a')
+      self.assertEqual(input_restore_args['a'].dtype, np.int8)
+      # 'b' is taken from `item`.
+      self.assertTrue(param_infos['b'].skip_deserialize)
+
+
+class PyTreeCheckpointHandlerTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.directory = epath.Path(self.create_tempdir(name='ckpt').full_path)
+
+  def test_restore_transforms_custom_item_with_empty_nodes(self):
+    handler = PyTreeCheckpointHandler()
+    saved = {
+        'a': np.arange(4),
+        'b': {'c': np.ones(2), 'y.z': np.zeros(3)},
+        'empty': {},
+        'none': None,
+        'list': [],
+    }
+    handler.save(self.directory, args=PyTreeSaveArgs(saved))
+    handler.finalize(self.directory)
+
+    item = _RestoredTree(
+        a=np.zeros(4, dtype=np.int64),
+        b={'c': np.zeros(2), 'y.z': np.zeros(3)},
+        empty={},
+        renamed=np.zeros(4, dtype=np.int64),
+    )
+    restored = handler.restore(
+        self.directory,
+        args=PyTreeRestoreArgs(
+            item=item,
+            restore_args=jax.tree.map(lambda _: RestoreArgs(), item),
+            transforms={'renamed': Transform(original_key='a')},
+        ),
+    )
+    self.assertIsInstance(restored, _RestoredTree)
+    test_utils.assert_tree_equal(
+        self,
+        _RestoredTree(
+            a=saved['a'], b=saved['b'], empty={}, renamed=saved['a']
+        ),
+        restored,
+    )
+
+  @parameterized.parameters(
+      (None, None, 10**9),
+      (None, 2, 2 * 10**9),
+      ({}, None, 10**9),
+      ({}, 2, 2 * 10**9),
+  )
+  def test_restore_concurrent_gb(
+      self, transforms, concurrent_gb, expected_concurrent_bytes
+  ):
+    handler, tree, restore_args = test_utils.concurrent_gb_test_setup()
+    handler.save(self.directory, args=PyTreeSaveArgs(tree))
+
+    with mock.patch.object(
+        serialization,
+        'get_byte_limiter',
+        wraps=serialization.get_byte_limiter,
+    ) as get_byte_limiter:
+      restored = handler.restore(
+          self.directory,
+          args=PyTreeRestoreArgs(
+              item=tree,
+              restore_args=restore_args,
+              transforms=transforms,
+              concurrent_gb=concurrent_gb,
+          ),
+      )
+    get_byte_limiter.assert_called_once_with(expected_concurrent_bytes)
+    test_utils.assert_tree_equal(self, tree, restored)
+
+
+class _PrefixedNamesHandler(BasePyTreeCheckpointHandler):
+
+  def get_param_names(self, item):
+    return jax.tree.map(
+        lambda name: f'prefix_{name}', super().get_param_names(item)
+    )
+
+
+class BasePyTreeCheckpointHandlerTest(parameterized.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.directory = epath.Path(self.create_tempdir(name='ckpt').full_path)
+
+  def test_overridden_get_param_names(self):
+    handler = _PrefixedNamesHandler(use_ocdbt=False)
+    item = {'a': np.arange(4), 'b': {'c': np.ones(2)}, 'd': {}}
+    handler.save(self.directory, args=BasePyTreeSaveArgs(item))
+    self.assertTrue((self.directory / 'prefix_a').exists())
+    self.assertTrue((self.directory / 'prefix_b.c').exists())
+    self.assertFalse((self.directory / 'a').exists())
+
+    restored = handler.restore(self.directory, args=BasePyTreeRestoreArgs())
+    test_utils.assert_tree_equal(self, item, restored)
+
+  @parameterized.parameters(5, 9)
+  def test_restore_concurrent_bytes(self, limit_bytes):
+    sleep_time = 0.5
+    _, tree, restore_args = test_utils.concurrent_gb_test_setup()
+    handler = BasePyTreeCheckpointHandler(
+        restore_concurrent_bytes=10**9, use_ocdbt=False
+    )
+    handler.save(self.directory, args=BasePyTreeSaveArgs(tree))
+
+    requested_concurrent_bytes = []
+    byte_limiter = None
+
+    def _get_byte_limiter(concurrent_bytes):
+      nonlocal byte_limiter
+      requested_concurrent_bytes.append(concurrent_bytes)
+      byte_limiter = test_utils.get_byte_limiter(concurrent_bytes, sleep_time)
+      return byte_limiter
+
+    with mock.patch.object(
+        serialization, 'get_byte_limiter', new=_get_byte_limiter
+    ):
+      restored = handler.restore(
+          self.directory,
+          args=BasePyTreeRestoreArgs(
+              item=tree,
+              restore_args=restore_args,
+              concurrent_bytes=limit_bytes,
+          ),
+      )
+    test_utils.assert_tree_equal(self, tree, restored)
+    self.assertEqual(requested_concurrent_bytes, [limit_bytes])
+    # Each array is a single 4-byte chunk, so `limit_bytes // 4` reads fit.
+    test_utils.assert_every_n_is_x_apart(
+        self,
+        byte_limiter.completion_times,
+        limit_bytes // 4,
+        sleep_time,
+    )
+
+  def test_batched_serialization_requests_indices(self):
+    tree = _AliasedKeysNode(np.arange(2), np.arange(3))
+    param_infos = _AliasedKeysNode(ParamInfo(name='x0'), ParamInfo(name='x1'))
+    save_args = _AliasedKeysNode(SaveArgs(), SaveArgs())
+    (request,) = base_pytree_checkpoint_handler.batched_serialization_requests(
+        tree,
+        param_infos,
+        save_args,
+        type_handlers.GLOBAL_TYPE_HANDLER_REGISTRY,
+    )
+    # Both keys have the same string form; the leaf index tells them apart.
+    self.assertEqual(request.keys, [('x',), ('x',)])
+    self.assertEqual(request.indices, [0, 1])
+    self.assertEqual([info.name for info in request.infos], ['x0', 'x1'])
+    self.assertEqual([v.size for v in request.values], [2, 3])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -17,7 +17,7 @@
 from __future__ import annotations
 
 import dataclasses
-from typing import Any, List, Optional
+from typing import Any, List, Optional, Sequence, Tuple
 
 from absl import logging
 from etils import epath
@@ -37,6 +37,49 @@ CheckpointArgs = checkpoint_args.CheckpointArgs
 register_with_handler = checkpoint_args.register_with_handler
 
 
+def _find_unsupported_leaf(
+    leaves: Sequence[Any], supported_types: Tuple[type, ...]
+) -> Optional[int]:
+  """Returns the index of the first leaf not of `supported_types`, if any."""
+  for i, x in enumerate(leaves):
+    if not isinstance(x, supported_types):
+      return i
+  return None
+
+
+def _find_unsupported_save_leaf(
+    leaves: Sequence[Any],
+    flat_save_args: Sequence[Any],
+    supported_types: Tuple[type, ...],
+) -> Optional[int]:
+  """Like `_find_unsupported_leaf`, also rejecting `aggregate` save args."""
+  for i, (x, arg) in enumerate(zip(leaves, flat_save_args)):
+    if (arg is not None and arg.aggregate) or not isinstance(
+        x, supported_types
+    ):
+      return i
+  return None
+
+
+def _leaf_keypath(item: PyTree, index: int) -> Tuple[Any, ...]:
+  """Returns the keypath of the `index`-th leaf of `item`.
+
+  Validation runs over plain leaves, so key paths are only recovered here, on
+  the failure path.
+
+  Args:
+    item: The validated PyTree.
+    index: Position of the leaf in `jax.tree.leaves(item)`.
+  """
+  return jax.tree_util.tree_flatten_with_path(item)[0][index][0]
+
+
+def _build_typed_error(item: PyTree, leaf: Any, index: int) -> ValueError:
+  """Builds the error for an unsupported `leaf` at position `index`."""
+  k = tree_utils.tuple_path_from_keypath(_leaf_keypath(item, index))
+  return ValueError(f'Unsupported type: {type(leaf)} for key: {k}.')
+
+
 class StandardCheckpointHandler(
     async_checkpoint_handler.AsyncCheckpointHandler
 ):
@@ -80,6 +123,9 @@ class StandardCheckpointHandler(
       multiprocessing_options: See orbax.checkpoint.options.
     """
     self._supported_types = checkpoint_utils.STANDARD_ARRAY_TYPES
+    self._restore_supported_types = self._supported_types + (
+        jax.ShapeDtypeStruct,
+    )
     self._impl = pytree_checkpoint_handler.PyTreeCheckpointHandler(
         save_concurrent_gb=save_concurrent_gb,
         restore_concurrent_gb=restore_concurrent_gb,
@@ -91,28 +137,30 @@ class StandardCheckpointHandler(
   ):
     if item is None:
       raise ValueError('Must provide item to save.')
-    if save_args is None:
-      save_args = jax.tree.map(lambda x: None, item)
-
-    def _check_input(k, x, arg):
-      if arg is not None:
-        if arg.aggregate:
-          raise ValueError(f'Unsupported option `aggregate` for key: {k}.')
-      if not isinstance(x, self._supported_types):
-        k = tree_utils.tuple_path_from_keypath(k)
-        raise ValueError(f'Unsupported type: {type(x)} for key: {k}.')
 
-    jax.tree_util.tree_map_with_path(_check_input, item, save_args)
+    leaves, treedef = jax.tree.flatten(item)
+    if save_args is None:
+      # No per-leaf args to check, so avoid building a tree of Nones.
+      flat_save_args = None
+      bad_index = _find_unsupported_leaf(leaves, self._supported_types)
+    else:
+      flat_save_args = treedef.flatten_up_to(save_args)
+      bad_index = _find_unsupported_save_leaf(
+          leaves, flat_save_args, self._supported_types
+      )
+    if bad_index is None:
+      return
+    arg = None if flat_save_args is None else flat_save_args[bad_index]
+    if arg is not None and arg.aggregate:
+      k = _leaf_keypath(item, bad_index)
+      raise ValueError(f'Unsupported option `aggregate` for key: {k}.')
+    raise _build_typed_error(item, leaves[bad_index], bad_index)
 
   def _validate_restore_state(self, item: PyTree):
-    def _check_input(k, x):
-      if not isinstance(x, self._supported_types) and not isinstance(
-          x, jax.ShapeDtypeStruct
-      ):
-        k = tree_utils.tuple_path_from_keypath(k)
-        raise ValueError(f'Unsupported type: {type(x)} for key: {k}.')
-
-    jax.tree_util.tree_map_with_path(_check_input, item)
+    leaves = jax.tree.leaves(item)
+    bad_index = _find_unsupported_leaf(leaves, self._restore_supported_types)
+    if bad_index is not None:
+      raise _build_typed_error(item, leaves[bad_index], bad_index)
 
   async def async_save(
       self,
@@ -194,6 +242,13 @@ class StandardCheckpointHandler(
       )
     if not args:
       args = StandardRestoreArgs(item=item)
+    if args.item is not None and not jax.tree.leaves(args.item):
+      # Nothing needs to be read from the checkpoint.
+      if not directory.exists():
+        raise FileNotFoundError(
+            f'Requested directory for restore does not exist at {directory}.'
+        )
+      return args.item
     if args.item is not None:
       self._validate_restore_state(args.item)
       restore_args = checkpoint_utils.construct_restore_args(args.item)
@@ -210,7 +265,9 @@ class StandardCheckpointHandler(
     return self._impl.restore(
         directory,
         args=pytree_checkpoint_handler.PyTreeRestoreArgs(
-            item=args.item, restore_args=restore_args
+            item=args.item,
+            restore_args=restore_args,
+            concurrent_gb=args.concurrent_gb,
         ),
     )
 
@@ -259,6 +316,10 @@ class StandardRestoreArgs(CheckpointArgs):
         `item` is a custom PyTree class, the tree will be restored with the
         same structure as provided. If not provided, restores as a serialized
         nested dict representation of the custom class.
+    concurrent_gb: max concurrent GB that are allowed to be read for this
+        restore, overriding the handler's `restore_concurrent_gb`. Limits how
+        many parameter reads from TensorStore may be in flight at once.
   """
 
   item: Optional[PyTree] = None
+  concurrent_gb: Optional[int] = None
@@ -16,6 +16,7 @@
 
 import functools
 from typing import Any
+from unittest import mock
 
 from absl.testing import parameterized
 from etils import epath
@@ -26,9 +27,11 @@ from jax import numpy as jnp
 import numpy as np
 import optax
 from orbax.checkpoint import multihost
+from orbax.checkpoint import serialization
 from orbax.checkpoint import test_utils
 from orbax.checkpoint import type_handlers
 from orbax.checkpoint import utils
+from orbax.checkpoint._src.handlers import pytree_checkpoint_handler
 from orbax.checkpoint._src.handlers import standard_checkpoint_handler
 
 PyTree = Any
@@ -123,6 +126,25 @@ class StandardCheckpointHandlerTestBase:
       self.assertTrue(type_handlers.is_ocdbt_checkpoint(self.directory))
       test_utils.assert_tree_equal(self, self.pytree, restored)
 
+    @parameterized.parameters((None, 10**9), (2, 2 * 10**9))
+    def test_restore_concurrent_gb(self, concurrent_gb, expected_bytes):
+      self.handler.save(self.directory, args=self.save_args_cls(self.pytree))
+      handler = StandardCheckpointHandler(restore_concurrent_gb=1)
+      with mock.patch.object(
+          serialization,
+          'get_byte_limiter',
+          wraps=serialization.get_byte_limiter,
+      ) as get_byte_limiter:
+        restored = handler.restore(
+            self.directory,
+            args=self.restore_args_cls(
+                self.zeros_pytree, concurrent_gb=concurrent_gb
+            ),
+        )
+      get_byte_limiter.assert_called_once_with(expected_bytes)
+      test_utils.assert_tree_equal(self, self.pytree, restored)
+      handler.close()
+
     def test_shape_dtype_struct(self):
       """Test case."""
       self.handler.save(
@@ -250,6 +272,34 @@ class StandardCheckpointHandlerTestBase:
       )
       test_utils.assert_tree_equal(self, restored, {'b': None})
 
+    @parameterized.parameters(
+        ({},),
+        ({'b': None},),
+        ({'a': {}, 'b': [None, ()], 'c': {'d': {}}},),
+    )
+    def test_restore_leafless_target(self, target):
+      """Test case."""
+      self.handler.save(self.directory, args=self.save_args_cls(self.pytree))
+      with mock.patch.object(
+          pytree_checkpoint_handler.PyTreeCheckpointHandler,
+          'restore',
+          autospec=True,
+      ) as pytree_restore:
+        restored = self.handler.restore(
+            self.directory, args=self.restore_args_cls(target)
+        )
+      # Nothing is read from the checkpoint.
+      pytree_restore.assert_not_called()
+      self.assertEqual(restored, target)
+
+    @parameterized.parameters(({},), ({'b': None},))
+    def test_restore_leafless_target_missing_directory(self, target):
+      """Test case."""
+      with self.assertRaises(FileNotFoundError):
+        self.handler.restore(
+            self.directory / 'missing', args=self.restore_args_cls(target)
+        )
+
     def test_masked_shape_dtype_struct(self):
       """Test case."""
 
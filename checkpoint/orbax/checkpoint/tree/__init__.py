@@ -27,6 +27,7 @@ from orbax.checkpoint.tree.utils import (
     is_empty_node,
     is_empty_or_leaf,
     is_sequence_key,
+    param_name_from_keypath,
     serialize_tree,
     to_flat_dict,
     to_shape_dtype_struct,
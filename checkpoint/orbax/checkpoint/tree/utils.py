@@ -314,14 +314,15 @@ def to_shape_dtype_struct(
     raise ValueError(f'Unexpected type: {type(x)}.')
 
 
-def get_param_names(item: PyTree) -> PyTree:
-  """Gets parameter names for PyTree elements."""
+def param_name_from_keypath(keypath: Tuple[Any, ...]) -> str:
+  """Converts JAX keypath tuple to a parameter name (see `get_param_names`)."""
+  return '.'.join([str(get_key_name(k)) for k in keypath])
 
-  def _param_name_from_keypath(keypath: Tuple[Any, ...]) -> str:
-    return '.'.join([str(get_key_name(k)) for k in keypath])
 
+def get_param_names(item: PyTree) -> PyTree:
+  """Gets parameter names for PyTree elements."""
   return jax.tree_util.tree_map_with_path(
-      lambda kp, _: _param_name_from_keypath(kp),
+      lambda kp, _: param_name_from_keypath(kp),
       item,
       is_leaf=is_empty_or_leaf,
   )
@@ -76,8 +76,7 @@ RESTORE_TYPE_UNKNOWN = 'Unknown'
 # TODO: b/365169723 - Handle empty NamedTuple.
 
 _SHARDING = '_sharding'
-_SHARDING_SUFFIX_RE = r'/\d+(\.\d+)*$'  # /0, /0.0, /1.0.1, etc.
-_ZARRAY_SUFFIX_RE = r'/\.zarray$'
+_SHARDING_SUFFIX_RE = re.compile(r'/\d+(\.\d+)*$')  # /0, /0.0, /1.0.1, etc.
 _ZARRAY_SUFFIX = '/.zarray'
 
 
@@ -595,10 +594,10 @@ async def _validate_params(
           ts_param,
       )
     # b/0.0 -> b, a/0 -> a, a/.zarray -> a/.zarray
-    ts_param = re.sub(_SHARDING_SUFFIX_RE, '', ts_param)
+    ts_param = _SHARDING_SUFFIX_RE.sub('', ts_param)
     if ts_param.endswith(_ZARRAY_SUFFIX):
       # a/.zarray -> a
-      ts_param = re.sub(_ZARRAY_SUFFIX_RE, '', ts_param)
+      ts_param = ts_param[: -len(_ZARRAY_SUFFIX)]
       with_zarray.add(ts_param)
       if logging.vlog_is_on(1):
         logging.vlog(
@@ -912,7 +911,11 @@ class NumpyHandler(TypeHandler):
     check_input_arguments(values, infos, args)
     if logging.vlog_is_on(1):
       _print_ts_debug_data(self._metadata_key, infos)
-    copied_values = [copy.deepcopy(v) for v in values]
+    # Copying is CPU-bound; run it off the event loop so that serialization of
+    # other parameters (e.g. device-to-host transfers) can make progress.
+    copied_values = await asyncio_utils.as_async_function(
+        lambda: [copy.deepcopy(v) for v in values]
+    )()
     return [
         _CommitFuture(
             self._background_serialize(copied_values, infos, args),